@@ -0,0 +1,146 @@
+# cython: language_level=3
+"""
+Compiled version of `resp.parse_frame`.
+
+Build in place with `python setup.py build_ext --inplace`.
+When this extension isn't built, `app.resp` uses its pure-Python parser instead.
+"""
+
+
+cimport cython
+
+from cpython.bytes cimport PyBytes_FromStringAndSize
+from libc.string cimport memchr
+
+
+cdef enum:
+    CR          = 13  # '\r'
+    LF          = 10  # '\n'
+    ARRAY       = 42  # '*'
+    BULK_STRING = 36  # '$'
+
+    # see `resp.MAX_LENGTH_DIGITS`: 18 digits always fit in a Py_ssize_t
+    MAX_LENGTH_DIGITS = 18
+    MAX_LENGTH_LINE   = 1 + MAX_LENGTH_DIGITS + 2
+
+    # see `resp.MAX_LENGTH`
+    MAX_LENGTH = 512 * 1024 * 1024
+
+
+cdef Py_ssize_t find_terminator(const unsigned char* data, Py_ssize_t size, Py_ssize_t start):
+    """
+    Return the index of the next '\r\n' at or after `start`, or -1 if there is none.
+    """
+
+    cdef const unsigned char* found
+
+    while start < size - 1:
+        found = <const unsigned char*>memchr(data + start, CR, size - 1 - start)
+        if found == NULL:
+            return -1
+
+        start = found - data
+        if data[start + 1] == LF:
+            return start
+
+        start += 1
+
+    return -1
+
+
+cdef Py_ssize_t parse_length_line(
+    const unsigned char* data, Py_ssize_t size, Py_ssize_t position, unsigned char marker, Py_ssize_t* length
+) except -2:
+    """
+    Parse the length line (`marker`, a non-negative decimal length, terminator) starting at `position`
+    into `length`. Return the offset just past the line, or -1 if the line isn't complete yet.
+    """
+
+    cdef Py_ssize_t value = 0
+    cdef Py_ssize_t end, index
+
+    if position >= size:
+        return -1
+
+    if data[position] != marker:
+        raise ValueError(f'Expected {bytes([marker])}, got {data[position:position + 1]}')
+
+    end = find_terminator(data, min(size, position + MAX_LENGTH_LINE), position + 1)
+    if end == -1:
+        if size >= position + MAX_LENGTH_LINE:
+            raise ValueError(f'Expected a length of at most {MAX_LENGTH_DIGITS} digits')
+        return -1
+
+    if end == position + 1:
+        raise ValueError(f'Expected a length, got {data[position + 1:end]}')
+
+    for index in range(position + 1, end):
+        if not 48 <= data[index] <= 57:
+            raise ValueError(f'Expected a length, got {data[position + 1:end]}')
+        value = value * 10 + (data[index] - 48)
+
+    if value > MAX_LENGTH:
+        raise ValueError(f'Expected a length of at most {MAX_LENGTH}, got {value}')
+
+    length[0] = value
+    return end + 2
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef object parse_frame(const unsigned char[::1] buffer, Py_ssize_t offset=0, tuple partial=None):
+    """
+    Parse one command frame (an array of bulk strings) from `buffer`, starting at `offset`.
+
+    Return `(num_commands, commands, position)`. The frame is complete once `len(commands) == num_commands`,
+    and `position` is then the offset just past it. Otherwise `position` is where parsing stopped, and
+    passing the returned tuple back as `partial` (once more data has arrived) resumes from there.
+    Return `None` if not even the frame's header is complete. Raise `ValueError` on a malformed frame.
+    """
+
+    cdef Py_ssize_t size = buffer.shape[0]
+    cdef const unsigned char* data
+    cdef Py_ssize_t end, position, start, length, num_commands
+    cdef list commands
+
+    if size == 0:
+        return None if partial is None else partial
+
+    data = &buffer[0]
+
+    if partial is None:
+        # note: indexes aren't bounds-checked, so offsets must not be negative
+        if offset < 0:
+            raise ValueError(f'Expected a non-negative offset, got {offset}')
+
+        position = parse_length_line(data, size, offset, ARRAY, &num_commands)
+        if position == -1:
+            return None
+
+        commands = []
+    else:
+        num_commands, commands, position = partial
+
+        if position < 0:
+            raise ValueError(f'Expected a non-negative offset, got {position}')
+
+    while len(commands) < num_commands:
+
+        start = parse_length_line(data, size, position, BULK_STRING, &length)
+        if start == -1:
+            break
+
+        # note: compare before adding, so that `start + length` can't overflow
+        if length > size - start - 2:
+            break
+
+        end = start + length
+
+        # terminator not found after `length` bytes
+        if data[end] != CR or data[end + 1] != LF:
+            raise ValueError(f"Expected b'\\r\\n', got {data[end:end + 2]}")
+
+        commands.append(PyBytes_FromStringAndSize(<const char*>data + start, length))
+        position = end + 2
+
+    return num_commands, commands, position
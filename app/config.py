@@ -6,3 +6,13 @@ config = {
         'master_repl_offset': 0
     }
 }
+
+# bumped on every change to `config`, so that cached views of it (e.g. INFO replies) can be invalidated
+version = 0
+
+
+def set_replication_role(role: str):
+    global version
+
+    config['replication']['role'] = role
+    version += 1
@@ -1,108 +1,269 @@
 import asyncio
 import argparse
+import os
+import signal
+import socket
+import sys
+
+try:
+    # uvloop is a drop-in replacement for the default asyncio event loop (built on libuv).
+    # Reference: https://github.com/MagicStack/uvloop
+    import uvloop
+except ImportError:
+    uvloop = None
 
 from . import resp
 from . import config
 
 
-replica_connections = []
+replica_connections: set[asyncio.Transport] = set()
 write_commands = set([resp.Command.SET])
 
+# whether clients are refused write commands (see --workers)
+read_only = False
+
+# signals the supervisor process forwards to its workers (see --workers)
+SUPERVISED_SIGNALS = {signal.SIGTERM, signal.SIGINT}
+
+
+# the handshake commands never change, so they are encoded once and sent as a single (pipelined) write
+HANDSHAKE_PAYLOAD = resp.Constant.EMPTY_BYTE.join([
+    resp.encode(resp.DataType.ARRAY, [
+        resp.encode(resp.DataType.BULK_STRING, resp.Command.PING)
+    ]),
+    resp.encode(resp.DataType.ARRAY, [
+        resp.encode(resp.DataType.BULK_STRING, resp.Command.REPLCONF),
+        resp.encode(resp.DataType.BULK_STRING, b'listening-port'),
+        resp.encode(resp.DataType.BULK_STRING, b'6380')
+    ]),
+    resp.encode(resp.DataType.ARRAY, [
+        resp.encode(resp.DataType.BULK_STRING, resp.Command.REPLCONF),
+        resp.encode(resp.DataType.BULK_STRING, b'capa'),
+        resp.encode(resp.DataType.BULK_STRING, b'psync2')
+    ]),
+    resp.encode(resp.DataType.ARRAY, [
+        resp.encode(resp.DataType.BULK_STRING, resp.Command.PSYNC),
+        resp.encode(resp.DataType.BULK_STRING, b'?'),
+        resp.encode(resp.DataType.BULK_STRING, b'-1')
+    ]),
+])
+
 
 async def send_handshake(address):
     host, port = address
     reader, writer = await asyncio.open_connection(host=host, port=port)
 
-    writer.write(
-        await resp.encode(resp.DataType.ARRAY, [
-            await resp.encode(resp.DataType.BULK_STRING, resp.Command.PING.encode())
-        ])        
-    )
+    writer.write(HANDSHAKE_PAYLOAD)
     await writer.drain()
 
-    await resp.parse_response(reader)
+    # one response per command: PING, REPLCONF, REPLCONF, PSYNC
+    for _ in range(4):
+        await resp.parse_response(reader)
 
-    writer.write(
-        await resp.encode(resp.DataType.ARRAY, [
-            await resp.encode(resp.DataType.BULK_STRING, resp.Command.REPLCONF.encode()),
-            await resp.encode(resp.DataType.BULK_STRING, 'listening-port'.encode()),
-            await resp.encode(resp.DataType.BULK_STRING, '6380'.encode())
-        ])        
-    )
-    await writer.drain()
 
-    await resp.parse_response(reader)
+class RESPProtocol(asyncio.Protocol):
+    """
+    Serve one client connection: buffer incoming bytes, execute every complete 
+    command frame and write the result back to the transport.
+    """
 
-    writer.write(
-        await resp.encode(resp.DataType.ARRAY, [
-            await resp.encode(resp.DataType.BULK_STRING, resp.Command.REPLCONF.encode()),
-            await resp.encode(resp.DataType.BULK_STRING, 'capa'.encode()),
-            await resp.encode(resp.DataType.BULK_STRING, 'psync2'.encode())
-        ])        
-    )
-    await writer.drain()
+    # consumed bytes are dropped from the receive buffer only once this many have piled up
+    COMPACT_THRESHOLD = 4096
 
-    await resp.parse_response(reader)
+    # a replica that lets this much output pile up unsent is disconnected, instead of buffering without bound
+    REPLICA_BUFFER_LIMIT = 16 * 1024 * 1024
 
-    writer.write(
-        await resp.encode(resp.DataType.ARRAY, [
-            await resp.encode(resp.DataType.BULK_STRING, resp.Command.PSYNC.encode()),
-            await resp.encode(resp.DataType.BULK_STRING, '?'.encode()),
-            await resp.encode(resp.DataType.BULK_STRING, '-1'.encode())
-        ])        
-    )
-    await writer.drain()
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        self.buffer    = bytearray()
+        self.offset    = 0     # start of the first unparsed frame in `buffer`
+        self.partial   = None  # progress on the frame at `offset`, if it's only partially received
+
+    def connection_lost(self, exc: Exception | None):
+        replica_connections.discard(self.transport)
 
-    await resp.parse_response(reader)
+    def pause_writing(self):
+        # the peer isn't reading its replies: stop reading its requests until it has caught up
+        self.transport.pause_reading()
 
+    def resume_writing(self):
+        self.transport.resume_reading()
 
-async def handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
-    while True:
-        commands = await resp.parse_commands(reader)
-        
-        if commands and commands[0].lower() == resp.Command.REPLCONF and commands[1] == 'listening-port':
-            replica_connections.append((reader, writer))
-            print(replica_connections)
+    def data_received(self, data: bytes):
+        self.buffer += data
+
+        while True:
+            try:
+                frame = resp.parse_frame(self.buffer, self.offset, self.partial)
+            except ValueError as e:
+                self.protocol_error(e)
+                return
+
+            if frame is None:
+                break
+
+            num_commands, commands, end = frame
+            if len(commands) < num_commands:
+                # resume from here once more data has arrived, instead of re-parsing the whole frame
+                self.partial = frame
+                break
+
+            # every frame spans at least its header, so parsing must always move forward
+            if end <= self.offset:
+                self.protocol_error(ValueError(f'Frame parsing made no progress at offset {self.offset}'))
+                return
+
+            self.partial = None
+            self.handle(commands, self.offset, end)
+            self.offset = end
+
+        if self.offset == len(self.buffer) or self.offset > self.COMPACT_THRESHOLD:
+            del self.buffer[:self.offset]
+            if self.partial:
+                num_commands, commands, position = self.partial
+                self.partial = (num_commands, commands, position - self.offset)
+            self.offset = 0
+
+    def protocol_error(self, error: ValueError):
+        resp.logger.error(error)
+        self.transport.write(resp.INVALID_CMD_REPLY)
+        self.transport.close()
+
+    def handle(self, commands: list[bytes], frame_start: int, frame_end: int):
+        if len(commands) > 1 and commands[0].lower() == resp.Command.REPLCONF and commands[1] == b'listening-port':
+            replica_connections.add(self.transport)
+            resp.logger.debug('replica added: %s', self.transport)
+
+        if read_only and commands and commands[0].lower() in write_commands:
+            self.transport.write(resp.READONLY_REPLY)
+            return
+
+        try:
+            result = resp.execute_commands(commands)
+        except Exception as e:
+            # e.g. missing arguments or an unknown INFO section: report it, but keep serving the connection
+            resp.logger.exception(e)
+            self.transport.write(resp.INVALID_CMD_REPLY)
+            return
 
-        result = await resp.execute_commands(commands)
         if type(result) == list:
-            for _result in result:
-                writer.write(_result)
-                await writer.drain()
+            self.transport.writelines(result)
         else:
-            writer.write(result)
-            await writer.drain()
+            self.transport.write(result)
 
-        commands_bytes = await resp.encode(resp.DataType.ARRAY, [
-            (await resp.encode(resp.DataType.BULK_STRING, command.encode())) for command in commands
-        ])
-        if commands[0].lower() in write_commands:
-            for _, writer in replica_connections:
-                writer.write(commands_bytes)
-                await writer.drain()
-                print(f'sent {commands_bytes} to {writer} of {writer.get_extra_info('peername')}')
+        if commands and commands[0].lower() in write_commands:
+            # forward the frame exactly as it was received
+            commands_bytes = self.buffer[frame_start:frame_end]
+            for replica in list(replica_connections):
+                if replica.get_write_buffer_size() > self.REPLICA_BUFFER_LIMIT:
+                    resp.logger.error('disconnecting replica %s, it is not keeping up', replica)
+                    replica_connections.discard(replica)
+                    replica.abort()
+                    continue
 
+                replica.write(commands_bytes)
+                resp.logger.debug('replicated %d bytes to %s', len(commands_bytes), replica)
 
 
-async def main():
+def create_socket(host: str, port: int, reuse_port: bool):
+    """
+    Create a listening socket. With `reuse_port`, SO_REUSEPORT is set so that every worker process 
+    can bind its own socket to the same address and the kernel spreads connections across them.
+    """
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-p', '--port', type=int)
-    parser.add_argument('--replicaof', nargs=2, type=str)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen()
+    sock.setblocking(False)
+
+    return sock
 
-    args = parser.parse_args()
+
+async def main(args: argparse.Namespace):
+    global read_only
 
     HOST = '127.0.0.1'
     PORT = args.port or 6379
 
+    # every worker is a replica of its own (see --workers), so writes from clients would only reach one of them
+    read_only = args.workers > 1
+
     if args.replicaof:
-        config.config['replication']['role'] = 'slave'
+        config.set_replication_role('slave')
         await send_handshake(args.replicaof)
 
-    server = await asyncio.start_server(handler, host=HOST, port=PORT)
+    loop = asyncio.get_running_loop()
+    server = await loop.create_server(RESPProtocol, sock=create_socket(HOST, PORT, reuse_port=args.workers > 1))
     async with server:
-        await server.serve_forever()
+        # note: the expirer runs alongside the server, so that an error in it stops the server loudly
+        await asyncio.gather(server.serve_forever(), resp.expire_keys())
+
+
+def serve(args: argparse.Namespace):
+    if uvloop:
+        uvloop.run(main(args))
+    else:
+        asyncio.run(main(args))
+
+
+def supervise(workers: set[int]):
+    """
+    Forward SIGTERM/SIGINT to the worker processes and wait for all of them to exit.
+    """
+
+    def forward(signum, frame):
+        for pid in workers:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, SUPERVISED_SIGNALS)
+
+    while workers:
+        pid, _ = os.wait()
+        workers.discard(pid)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--port', type=int)
+    parser.add_argument('--replicaof', nargs=2, type=str)
+    parser.add_argument(
+        '--workers', type=int, default=1, 
+        help='number of processes serving the port; only for replicas, each worker being a read-only replica'
+    )
+
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+
+    # workers don't share `resp.store`: only replicas, whose keys all come from the master, can run several
+    if args.workers > 1 and not args.replicaof:
+        parser.error('--workers can only be used together with --replicaof')
+
+    if args.workers == 1:
+        serve(args)
+    else:
+        # fork before any event loop exists; each worker then runs its own loop on its own socket,
+        # while this process only supervises them
+        # note: signals are held off until the supervisor's handlers are in place
+        signal.pthread_sigmask(signal.SIG_BLOCK, SUPERVISED_SIGNALS)
+
+        workers = set()
+        for _ in range(args.workers):
+            pid = os.fork()
+            if pid == 0:
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, SUPERVISED_SIGNALS)
+                serve(args)
+                sys.exit()
+            workers.add(pid)
+
+        supervise(workers)
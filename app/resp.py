@@ -7,6 +7,7 @@ https://redis.io/docs/latest/develop/reference/protocol-spec/
 
 
 import asyncio
+import heapq
 import logging
 import time
 
@@ -42,22 +43,88 @@ class Constant:
 
 @dataclass
 class Command:
-    PING     = 'ping'
-    ECHO     = 'echo'
-    SET      = 'set'
-    GET      = 'get'
-    INFO     = 'info'
-    REPLCONF = 'replconf'
-    PSYNC    = 'psync'
+    PING     = b'ping'
+    ECHO     = b'echo'
+    SET      = b'set'
+    GET      = b'get'
+    INFO     = b'info'
+    REPLCONF = b'replconf'
+    PSYNC    = b'psync'
+
+
+# replies that don't depend on the request are encoded once, at import time
+PONG_REPLY        = b'+PONG\r\n'
+OK_REPLY          = b'+OK\r\n'
+INVALID_CMD_REPLY = b'-Invalid Command\r\n'
+READONLY_REPLY    = b"-READONLY You can't write against a read only replica.\r\n"
+
+
+# key -> (value, expiry in monotonic ms or None)
+store: dict[bytes, tuple[bytes, int | None]] = {}
+# min-heap of (expiry in monotonic ms, key); entries go stale when their key is overwritten
+_expiries: list[tuple[int, bytes]] = []
+# the heap is rebuilt from `store` once it holds this many entries beyond twice the number of keys
+EXPIRIES_SLACK = 64
+# the expirer yields to the event loop after popping this many entries in a row
+EVICTION_BATCH = 100
+rdb_state = bytes.fromhex('524544495330303131fa0972656469732d76657205372e322e30fa0a72656469732d62697473c040fa056374696d65c26d08bc65fa08757365642d6d656dc2b0c41000fa08616f662d62617365c000fff06e3bfec0ff5aa2')
+# note: following is NOT a RESP bulk string, as it doesn't contain a '\r\n' at the end
+RDB_FRAME = DataType.BULK_STRING + str(len(rdb_state)).encode() + Constant.TERMINATOR + rdb_state
 
+# section name -> encoded INFO reply, valid while `_info_cache_version` matches `config.version`
+_info_cache: dict[bytes, bytes] = {}
+_info_cache_version = 0
 
-store = {}
-rdb_state = bytes.fromhex('524544495330303131fa0972656469732d76657205372e322e30fa0a72656469732d62697473c040fa056374696d65c26d08bc65fa08757365642d6d656dc2b0c41000fa08616f662d62617365c000fff06e3bfec0ff5aa2')
 
+# a length line is a marker, at most 18 digits (so that a length always fits in 64 bits) and a terminator
+MAX_LENGTH_DIGITS = 18
+MAX_LENGTH_LINE   = 1 + MAX_LENGTH_DIGITS + 2
+
+# largest length accepted for an array or a bulk string (same as Redis' default `proto-max-bulk-len`),
+# so that a client can't make the server buffer an arbitrary amount of data for a single frame
+MAX_LENGTH = 512 * 1024 * 1024
+
+
+def parse_length_line(buffer: bytes | bytearray, position: int, marker: bytes):
+    """
+    Parse the length line (`marker`, a non-negative decimal length, terminator) starting at `position`.
+
+    Return `(length, end)` where `end` is the offset just past the line, or `None` if the line 
+    isn't complete yet. Raise `ValueError` on a malformed line.
+    """
+
+    if len(buffer) <= position:
+        return None
+
+    if not buffer.startswith(marker, position):
+        raise ValueError(f'Expected {marker}, got {bytes(buffer[position:position + 1])}')
+
+    end = buffer.find(Constant.TERMINATOR, position + 1, position + MAX_LENGTH_LINE)
+    if end == -1:
+        if len(buffer) >= position + MAX_LENGTH_LINE:
+            raise ValueError(f'Expected a length of at most {MAX_LENGTH_DIGITS} digits')
+        return None
+
+    digits = bytes(buffer[position + 1:end])
+    # note: unlike int(), isdigit() rejects signs, whitespaces and underscores
+    if not digits.isdigit():
+        raise ValueError(f'Expected a length, got {digits}')
 
-async def parse_commands(reader: asyncio.StreamReader):
+    length = int(digits)
+    if length > MAX_LENGTH:
+        raise ValueError(f'Expected a length of at most {MAX_LENGTH}, got {length}')
+
+    return length, end + 2
+
+
+def parse_frame(buffer: bytes | bytearray, offset: int = 0, partial: tuple | None = None):
     """
-    Parse commands (`bytes`) from socket stream using `reader` and return as a `list`.
+    Parse one command frame (an array of bulk strings) from `buffer`, starting at `offset`.
+
+    Return `(num_commands, commands, position)`. The frame is complete once `len(commands) == num_commands`, 
+    and `position` is then the offset just past it. Otherwise `position` is where parsing stopped, and 
+    passing the returned tuple back as `partial` (once more data has arrived) resumes from there.
+    Return `None` if not even the frame's header is complete. Raise `ValueError` on a malformed frame.
     
     Clients send commands to a Redis server as an array of bulk strings. 
     The first (and sometimes also the second) bulk string in the array is the command's name.
@@ -65,45 +132,49 @@ async def parse_commands(reader: asyncio.StreamReader):
     Example: *2\r\n$4\r\necho\r\n$3\r\nhello\r\n
     """
 
-    try:
-        print(f'reading from {reader}')
-        _ = await reader.read(1)
-        if _ != DataType.ARRAY:
-            logger.error(f'Expected {DataType.ARRAY}, got {_}')
-            return []
-        
-        num_commands = int(await reader.readuntil(Constant.TERMINATOR))
-        # note: even though read.readuntil() returns bytes along with the terminator,
-        # int() is able to handle bytes and surrounding whitespaces. 
-        # note: '\r' and '\n' are counted as whitespaces.
+    if partial is None:
+        header = parse_length_line(buffer, offset, DataType.ARRAY)
+        if header is None:
+            return None
 
+        num_commands, position = header
         commands = []
-        
+    else:
+        num_commands, commands, position = partial
+
+    # note: payloads are copied out of a memoryview, so each one is copied exactly once
+    with memoryview(buffer) as view:
+
         while len(commands) < num_commands:
-    
-            datatype = await reader.read(1)
 
-            if datatype == DataType.BULK_STRING:
-                length = int(await reader.readuntil(Constant.TERMINATOR))
-                data   = await reader.read(length)
+            line = parse_length_line(buffer, position, DataType.BULK_STRING)
+            if line is None:
+                break
+
+            length, start = line
+            end = start + length
+
+            if len(buffer) < end + 2:
+                break
 
-                _ = await reader.read(2) 
-                # terminator not found after `length` bytes
-                if _ != Constant.TERMINATOR:
-                    logger.error(f"Expected {Constant.TERMINATOR}, got {_}")
-                    return []
+            # terminator not found after `length` bytes
+            if not buffer.startswith(Constant.TERMINATOR, end):
+                raise ValueError(f'Expected {Constant.TERMINATOR}, got {bytes(buffer[end:end + 2])}')
 
-                commands.append(data.decode())
+            commands.append(view[start:end].tobytes())
+            position = end + 2
 
-            else:
-                logger.error(f'Expected {DataType.BULK_STRING}, got {datatype}')
-                return []
+    return num_commands, commands, position
 
-        return commands
 
-    except Exception as e:
-        logger.exception(e)
-        return []
+# keep the pure-Python parser reachable, e.g. to check the compiled one against it
+parse_frame_py = parse_frame
+
+try:
+    # prefer the compiled parser when it has been built (see app/_resp_parser.pyx)
+    from ._resp_parser import parse_frame
+except ImportError:
+    pass
 
 
 async def parse_response(reader: asyncio.StreamReader):
@@ -116,15 +187,14 @@ async def parse_response(reader: asyncio.StreamReader):
     
     async def parse_bulk_string():
         length = int(await reader.readuntil(Constant.TERMINATOR))
-        data   = await reader.read(length)
+        data   = await reader.readexactly(length + 2)
 
-        _ = await reader.read(2) 
         # terminator not found after `length` bytes
-        if _ != Constant.TERMINATOR:
-            logger.error(f"Expected {Constant.TERMINATOR}, got {_}")
+        if data[length:] != Constant.TERMINATOR:
+            logger.error(f"Expected {Constant.TERMINATOR}, got {data[length:]}")
             return Constant.EMPTY_BYTE
 
-        return data
+        return data[:length]
 
     async def parse_simple_string():
         data = await reader.readuntil(Constant.TERMINATOR)
@@ -166,7 +236,7 @@ async def parse_response(reader: asyncio.StreamReader):
         return await parse_simple_error()
             
 
-async def encode(datatype: DataType, data: bytes | list[bytes]):
+def encode(datatype: DataType, data: bytes | list[bytes]):
     """
     Encode data as per RESP specifications
     """
@@ -185,67 +255,140 @@ async def encode(datatype: DataType, data: bytes | list[bytes]):
         ])
     
 
-async def execute_commands(commands: list[str]):
+def _now_ms():
+    return time.monotonic_ns() // 1_000_000
+
+
+def _do_ping(commands: list[bytes]):
+    return PONG_REPLY
+
+
+def _do_echo(commands: list[bytes]):
+    return encode(DataType.SIMPLE_STRING, commands[1])
+
+
+def _do_set(commands: list[bytes]):
+    key   = commands[1]
+    value = commands[2]
+
+    px = None
+    if len(commands) == 5:
+        px = _now_ms() + int(commands[4])
+        heapq.heappush(_expiries, (px, key))
+
+    store[key] = (value, px)
+
+    # drop the stale entries once they outnumber the keys, so that overwriting a key doesn't grow the heap forever
+    if len(_expiries) > 2 * len(store) + EXPIRIES_SLACK:
+        _expiries[:] = [(px, key) for key, (_, px) in store.items() if px is not None]
+        heapq.heapify(_expiries)
+
+    return OK_REPLY
+
+
+def _do_get(commands: list[bytes]):
+    key = commands[1]
+
+    entry = store.get(key)
+    if entry is not None:
+        value, px = entry
+        if px is None or _now_ms() < px:
+            return encode(DataType.BULK_STRING, value)
+            
+        del store[key]
+
+    return Constant.NULL_BULK_STRING
+
+
+def _do_info(commands: list[bytes]):
+    global _info_cache_version
+
+    if _info_cache_version != config.version:
+        _info_cache.clear()
+        _info_cache_version = config.version
+
+    section = commands[1]
+
+    reply = _info_cache.get(section)
+    if reply is None:
+        section_config = config.config[section.decode()]        
+        data = '\n'.join([f'{key}:{value}' for key, value in section_config.items()]).encode()
+
+        reply = _info_cache[section] = encode(DataType.BULK_STRING, data)
+    
+    return reply
+
+
+def _do_replconf(commands: list[bytes]):
+    return OK_REPLY
+
+
+def _do_psync(commands: list[bytes]):
+    return [
+        encode(
+            DataType.SIMPLE_STRING, 
+            Constant.SPACE_BYTE.join([
+                Constant.FULLRESYNC, 
+                config.config['replication']['master_replid'].encode(), 
+                str(config.config['replication']['master_repl_offset']).encode()
+            ])
+        ),
+        RDB_FRAME
+    ]
+
+
+# command name (lowercase) -> handler
+_HANDLERS = {
+    Command.PING     : _do_ping,
+    Command.ECHO     : _do_echo,
+    Command.SET      : _do_set,
+    Command.GET      : _do_get,
+    Command.INFO     : _do_info,
+    Command.REPLCONF : _do_replconf,
+    Command.PSYNC    : _do_psync,
+}
+
+
+def execute_commands(commands: list[bytes]):
     """
     Execute commands and return the result.
     """
 
     if not commands:
-        return await encode(DataType.SIMPLE_ERROR, Constant.INVALID_COMMAND)
+        return INVALID_CMD_REPLY
     
-    if commands[0].lower() == Command.PING:
-        return await encode(DataType.SIMPLE_STRING, Constant.PONG)
-    
-    if commands[0].lower() == Command.ECHO:        
-        return await encode(DataType.SIMPLE_STRING, commands[1].encode())
+    handler = _HANDLERS.get(commands[0].lower())
+    return handler(commands) if handler else INVALID_CMD_REPLY
 
-    if commands[0].lower() == Command.SET:
-        key   = commands[1]
-        value = commands[2]
 
-        store[key] = {'value': value, 'px': None}
+async def expire_keys():
+    """
+    Evict keys as their TTL runs out, so that expired keys which are never read don't linger in `store`.
+    """
 
-        if len(commands) == 5:
-            px = int(commands[4])
-            store[key]['px'] = time.time() * 1000 + px
+    evicted = 0
 
-        return await encode(DataType.SIMPLE_STRING, Constant.OK)
+    while True:
+        if not _expiries:
+            await asyncio.sleep(1)
+            continue
 
-    if commands[0].lower() == Command.GET:
-        key = commands[1]
+        px, key = _expiries[0]
 
-        if key in store:
-            timestamp_ms = time.time() * 1000
-            if not store[key]['px'] or timestamp_ms < store[key]['px']:
-                return await encode(DataType.BULK_STRING, store[key]['value'].encode())
-                
-            store.pop(key)
+        wait_ms = px - _now_ms()
+        if wait_ms > 0:
+            # note: wake up at least once a second, as a sooner expiry may have been pushed meanwhile
+            await asyncio.sleep(min(wait_ms, 1000) / 1000)
+            continue
 
-        return Constant.NULL_BULK_STRING
+        heapq.heappop(_expiries)
 
-    if commands[0].lower() == Command.INFO:
-        section = commands[1]
+        # skip stale entries, i.e. the key was deleted or SET again since
+        entry = store.get(key)
+        if entry is not None and entry[1] == px:
+            del store[key]
 
-        section_config = config.config[section]        
-        data = '\n'.join([f'{key}:{value}' for key, value in section_config.items()]).encode()
-        
-        return await encode(DataType.BULK_STRING, data)
-
-    if commands[0].lower() == Command.REPLCONF:
-        return await encode(DataType.SIMPLE_STRING, Constant.OK)
-    
-    if commands[0].lower() == Command.PSYNC:
-        return [
-            await encode(
-                DataType.SIMPLE_STRING, 
-                Constant.SPACE_BYTE.join([
-                    Constant.FULLRESYNC, 
-                    config.config['replication']['master_replid'].encode(), 
-                    str(config.config['replication']['master_repl_offset']).encode()
-                ])
-            ),
-            # note: following is NOT a RESP bulk string, as it doesn't contain a '\r\n' at the end
-            Constant.EMPTY_BYTE.join([
-                DataType.BULK_STRING, str(len(rdb_state)).encode(), Constant.TERMINATOR, rdb_state
-            ]) 
-        ]
+        # let the connections run between batches, when many keys expire at once
+        evicted += 1
+        if evicted % EVICTION_BATCH == 0:
+            await asyncio.sleep(0)
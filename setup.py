@@ -0,0 +1,14 @@
+"""
+Build the optional Cython RESP parser (app/_resp_parser.pyx) in place:
+
+    pip install -r requirements-dev.txt
+    python setup.py build_ext --inplace
+
+The server doesn't need it to run: without the extension, `app.resp` uses its pure-Python parser.
+"""
+
+from setuptools import Extension, setup
+from Cython.Build import cythonize
+
+
+setup(ext_modules=cythonize([Extension('app._resp_parser', ['app/_resp_parser.pyx'])]))
@@ -0,0 +1,111 @@
+"""
+Tests for `RESPProtocol`, driven through a fake transport.
+
+Run with `python -m unittest` from the repository root.
+"""
+
+
+import unittest
+import unittest.mock
+
+from app import main
+from app import resp
+
+
+class FakeTransport:
+
+    def __init__(self):
+        self.output = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.output += data
+
+    def writelines(self, lines):
+        for data in lines:
+            self.write(data)
+
+    def close(self):
+        self.closed = True
+
+    def pause_reading(self):
+        pass
+
+    def resume_reading(self):
+        pass
+
+
+def command(*args: bytes):
+    return resp.encode(resp.DataType.ARRAY, [resp.encode(resp.DataType.BULK_STRING, arg) for arg in args])
+
+
+class TestRESPProtocol(unittest.TestCase):
+
+    def setUp(self):
+        resp.store.clear()
+        self.transport = FakeTransport()
+        self.protocol  = main.RESPProtocol()
+        self.protocol.connection_made(self.transport)
+
+    def feed(self, data: bytes, chunk_size: int):
+        for index in range(0, len(data), chunk_size):
+            self.protocol.data_received(data[index:index + chunk_size])
+
+    def test_fragmented(self):
+        self.feed(command(b'SET', b'k', b'hello') + command(b'GET', b'k') + command(b'PING'), 1)
+
+        self.assertEqual(bytes(self.transport.output), b'+OK\r\n$5\r\nhello\r\n+PONG\r\n')
+        self.assertIsNone(self.protocol.partial)
+
+    def test_compaction(self):
+        # pipelined frames, in chunks that don't line up with frame boundaries and exceed COMPACT_THRESHOLD
+        frames, replies = [], []
+        for index in range(200):
+            key, value = b'key%d' % index, b'v' * (index * 7)
+            frames += [command(b'SET', key, value), command(b'GET', key)]
+            replies += [resp.OK_REPLY, resp.encode(resp.DataType.BULK_STRING, value)]
+
+        data = b''.join(frames)
+        for chunk_size in (main.RESPProtocol.COMPACT_THRESHOLD + 1, 3 * main.RESPProtocol.COMPACT_THRESHOLD - 7):
+            with self.subTest(chunk_size=chunk_size):
+                self.transport.output.clear()
+                self.feed(data, chunk_size)
+
+                self.assertEqual(bytes(self.transport.output), b''.join(replies))
+                self.assertEqual((self.protocol.offset, len(self.protocol.buffer)), (0, 0))
+
+    def test_no_progress(self):
+        with self.assertLogs(resp.logger, 'ERROR'):
+            with unittest.mock.patch.object(resp, 'parse_frame', return_value=(0, [], 0)):
+                self.feed(command(b'PING'), 1024)
+
+        self.assertEqual(bytes(self.transport.output), resp.INVALID_CMD_REPLY)
+        self.assertTrue(self.transport.closed)
+
+    def test_failing_command(self):
+        for args in [(b'SET', b'k'), (b'INFO', b'bogus'), (b'SET', b'k', b'v', b'px', b'abc')]:
+            with self.subTest(args=args):
+                self.transport.output.clear()
+                with self.assertLogs(resp.logger, 'ERROR'):
+                    self.feed(command(*args) + command(b'PING'), 1024)
+
+                self.assertEqual(bytes(self.transport.output), resp.INVALID_CMD_REPLY + resp.PONG_REPLY)
+                self.assertFalse(self.transport.closed)
+
+    def test_read_only(self):
+        with unittest.mock.patch.object(main, 'read_only', True):
+            self.feed(command(b'SET', b'k', b'v') + command(b'GET', b'k'), 1024)
+
+        self.assertEqual(bytes(self.transport.output), resp.READONLY_REPLY + b'$-1\r\n')
+        self.assertNotIn(b'k', resp.store)
+
+    def test_length_too_large(self):
+        with self.assertLogs(resp.logger, 'ERROR'):
+            self.feed(b'*1\r\n$999999999\r\n', 1024)
+
+        self.assertEqual(bytes(self.transport.output), resp.INVALID_CMD_REPLY)
+        self.assertTrue(self.transport.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
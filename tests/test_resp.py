@@ -0,0 +1,85 @@
+"""
+Tests for the command handlers in `app.resp`.
+
+Run with `python -m unittest` from the repository root.
+"""
+
+
+import asyncio
+import unittest
+
+from app import config
+from app import resp
+
+
+class TestInfo(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(config.set_replication_role, config.config['replication']['role'])
+
+    def info(self):
+        return resp.execute_commands([b'INFO', b'replication'])
+
+    def test_role_change(self):
+        config.set_replication_role('master')
+        self.assertIn(b'role:master', self.info())
+
+        config.set_replication_role('slave')
+        reply = self.info()
+        self.assertIn(b'role:slave', reply)
+        self.assertNotIn(b'role:master', reply)
+
+    def test_cached(self):
+        reply = self.info()
+        self.assertIs(self.info(), reply)
+
+        config.set_replication_role('slave')
+        self.assertIsNot(self.info(), reply)
+
+
+class TestExpiry(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        resp.store.clear()
+        resp._expiries.clear()
+
+    async def expire(self):
+        # note: started once the keys are set, as an idle expirer only checks the heap once a second
+        expirer = asyncio.create_task(resp.expire_keys())
+        await asyncio.sleep(0.1)
+        expirer.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await expirer
+
+    async def test_evicted_without_get(self):
+        resp.execute_commands([b'SET', b'k', b'v', b'px', b'10'])
+        resp.execute_commands([b'SET', b'other', b'v'])
+
+        await self.expire()
+        self.assertEqual(resp.store.keys(), {b'other'})
+        self.assertEqual(resp._expiries, [])
+
+    async def test_many_evicted(self):
+        for index in range(5 * resp.EVICTION_BATCH):
+            resp.execute_commands([b'SET', b'key%d' % index, b'v', b'px', b'10'])
+
+        await self.expire()
+        self.assertEqual(resp.store, {})
+
+    async def test_overwritten(self):
+        resp.execute_commands([b'SET', b'k', b'v', b'px', b'10'])
+        resp.execute_commands([b'SET', b'k', b'new'])
+
+        await self.expire()
+        self.assertEqual(resp.execute_commands([b'GET', b'k']), b'$3\r\nnew\r\n')
+
+    async def test_heap_bounded(self):
+        for _ in range(10000):
+            resp.execute_commands([b'SET', b'k', b'v', b'px', b'100000'])
+
+        self.assertLessEqual(len(resp._expiries), 2 + resp.EXPIRIES_SLACK + 1)
+        self.assertEqual(resp._expiries[0][1], b'k')
+
+
+if __name__ == '__main__':
+    unittest.main()
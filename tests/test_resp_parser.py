@@ -0,0 +1,157 @@
+"""
+Tests for the RESP frame parser, and checks that the pure-Python and the compiled 
+(app/_resp_parser.pyx) parsers agree.
+
+Run with `python -m unittest` from the repository root.
+The compiled parser is only checked when it has been built.
+"""
+
+
+import unittest
+
+from app import resp
+
+try:
+    from app import _resp_parser
+except ImportError:
+    _resp_parser = None
+
+
+VALID = [
+    b'*1\r\n$4\r\nping\r\n',
+    b'*2\r\n$4\r\necho\r\n$3\r\nhey\r\n',
+    b'*3\r\n$3\r\nset\r\n$0\r\n\r\n$4\r\na\r\nb\r\n',
+    b'*0\r\n',
+]
+
+INCOMPLETE = [
+    b'*1\r\n$536870912\r\nabc\r\n',
+    b'*536870912\r\n$4\r\nping\r\n',
+]
+
+MALFORMED = [
+    b'garbage\r\n',
+    b'*-1\r\n',
+    b'* 1\r\n$4\r\nping\r\n',
+    b'*1 \r\n$4\r\nping\r\n',
+    b'*\r\n',
+    b'*1\r\n$-2\r\n',
+    b'*1\r\n$+4\r\nping\r\n',
+    b'*1\r\n$1_0\r\n0123456789\r\n',
+    b'*1\r\n+4\r\nping\r\n',
+    b'*1\r\n$4\r\npingxx',
+    b'*1\r\n$536870913\r\n',
+    b'*536870913\r\n',
+    b'*1\r\n$999999999999999999\r\nabc\r\n',
+    b'*1\r\n$9223372036854775800\r\nabc\r\n',
+    b'*1\r\n$1234567890123456789\r\n',
+    b'*1234567890123456789\r\n',
+    b'*1\r\n$4\r\nping\r\n*1\r\n$-26\r\n',
+]
+
+
+def parse(parse_frame, buffer, offset=0, partial=None):
+    try:
+        return parse_frame(buffer, offset, partial)
+    except ValueError:
+        return ValueError
+
+
+def parse_all(parse_frame, buffer):
+    """
+    Parse every frame in `buffer`, feeding it one byte at a time and resuming partial frames.
+    """
+
+    results = []
+    offset, partial = 0, None
+
+    for size in range(len(buffer) + 1):
+        while True:
+            frame = parse(parse_frame, buffer[:size], offset, partial)
+            if frame is ValueError:
+                return results + [ValueError]
+            if frame is None:
+                break
+
+            num_commands, commands, end = frame
+            if len(commands) < num_commands:
+                partial = frame
+                break
+
+            results.append(frame)
+            offset, partial = end, None
+
+    return results
+
+
+class TestPythonParser(unittest.TestCase):
+
+    def test_valid(self):
+        self.assertEqual(resp.parse_frame_py(VALID[1]), (2, [b'echo', b'hey'], len(VALID[1])))
+        self.assertEqual(resp.parse_frame_py(VALID[3]), (0, [], 4))
+
+    def test_partial(self):
+        self.assertIsNone(resp.parse_frame_py(b'*2\r'))
+        self.assertEqual(resp.parse_frame_py(b'*2\r\n$4\r\necho\r\n$3\r\nh'), (2, [b'echo'], 14))
+        self.assertEqual(
+            resp.parse_frame_py(b'*2\r\n$4\r\necho\r\n$3\r\nhey\r\n', 0, (2, [b'echo'], 14)),
+            (2, [b'echo', b'hey'], 23)
+        )
+
+    def test_incomplete(self):
+        for buffer in INCOMPLETE:
+            with self.subTest(buffer=buffer):
+                self.assertEqual(parse_all(resp.parse_frame_py, buffer), [])
+
+    def test_malformed(self):
+        for buffer in MALFORMED:
+            with self.subTest(buffer=buffer):
+                self.assertEqual(parse_all(resp.parse_frame_py, buffer)[-1], ValueError)
+
+    def test_fragmented(self):
+        buffer = b''.join(VALID)
+        self.assertEqual([commands for _, commands, _ in parse_all(resp.parse_frame_py, buffer)], [
+            [b'ping'], [b'echo', b'hey'], [b'set', b'', b'a\r\nb'], []
+        ])
+
+
+@unittest.skipIf(_resp_parser is None, 'compiled parser is not built')
+class TestCompiledParser(unittest.TestCase):
+
+    def assertAgree(self, buffer):
+        for offset in range(len(buffer) + 1):
+            for data in (buffer, bytearray(buffer)):
+                self.assertEqual(
+                    parse(_resp_parser.parse_frame, data, offset),
+                    parse(resp.parse_frame_py, data, offset)
+                )
+
+        self.assertEqual(parse_all(_resp_parser.parse_frame, buffer), parse_all(resp.parse_frame_py, buffer))
+
+    def test_valid(self):
+        for buffer in VALID:
+            with self.subTest(buffer=buffer):
+                self.assertAgree(buffer)
+
+    def test_incomplete(self):
+        for buffer in INCOMPLETE:
+            with self.subTest(buffer=buffer):
+                self.assertAgree(buffer)
+
+    def test_pipelined(self):
+        self.assertAgree(b''.join(VALID))
+
+    def test_malformed(self):
+        for buffer in MALFORMED:
+            with self.subTest(buffer=buffer):
+                self.assertAgree(buffer)
+
+    def test_negative_offset(self):
+        with self.assertRaises(ValueError):
+            _resp_parser.parse_frame(VALID[0], -1)
+        with self.assertRaises(ValueError):
+            _resp_parser.parse_frame(VALID[0], 0, (1, [], -5))
+
+
+if __name__ == '__main__':
+    unittest.main()